@@ -3,60 +3,298 @@ from discord.ext import commands, tasks
 from discord.ui import Select, View, Button, Modal, TextInput
 import asyncio
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 import asyncpg
 from typing import List, Optional
-import random
-import string
-import requests
+from collections import namedtuple
+import base64
+import json
+import aiohttp
 import io
+import logging
+import logging.handlers
+import queue
+import atexit
+
+# Use the libuv event loop when it's available (not on Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+def setup_logging():
+    """Route log records through a queue so handlers never block the event loop"""
+    log_queue = queue.Queue(-1)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(name)s: %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    
+    listener.start()
+    atexit.register(listener.stop)
+
 pool = None
+http_session = None
+_category_ids = {}  # (guild ID, category name) -> category channel ID
+_activity_buf = {}  # Ticket channel ID -> time of latest message, pending flush
+_seen_users = {}  # User ID -> display name of ticket message authors, pending flush
+_background_tasks = set()  # Fire-and-forget tasks started by run_in_background
+
+class TicketBot(commands.Bot):
+    async def setup_hook(self):
+        # Persistent view: routes the control buttons on every ticket, including after restarts
+        self.add_view(TicketControlView(is_staff=True))
+    
+    async def close(self):
+        await shutdown()
+        await super().close()
 
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+bot = TicketBot(command_prefix="!", intents=intents, help_command=None)
 
 # Configuration
 DATABASE_URL = os.getenv('DATABASE_URL')
-STAFF_ROLES = ["Ticket response team", "CREW", "LEAD CREW", "DEVELOPER", "MANAGEMENT", "COMMUNITY MANAGER", "OVERWATCHER"]
+PG_MIN_POOL = int(os.getenv('PG_MIN_POOL', '5'))
+PG_MAX_POOL = int(os.getenv('PG_MAX_POOL', '20'))
+STAFF_ROLES = frozenset({"Ticket response team", "CREW", "LEAD CREW", "DEVELOPER", "MANAGEMENT", "COMMUNITY MANAGER", "OVERWATCHER"})
+STAFF_ROLE_IDS = set()  # Resolved from STAFF_ROLES once the guilds are available
+OPEN_TICKET_CHANNELS = set()  # Channel IDs of open tickets, loaded by init_db
+TicketCategory = namedtuple("TicketCategory", "name emoji")
 TICKET_CATEGORIES = {
-    "reportPlayer": {"name": "Report a Player", "emoji": "⚠️"},
-    "reportBug": {"name": "Report Bug", "emoji": "🐛"},
-    "buyBusiness": {"name": "Buy a Business", "emoji": "💼"},
-    "buyEDM": {"name": "Buy EDMs", "emoji": "🏎️"},
-    "bookAuction": {"name": "Book an Auction Ticket", "emoji": "🎫"},
-    "other": {"name": "Other Issues", "emoji": "📝"}
+    "reportPlayer": TicketCategory(name="Report a Player", emoji="⚠️"),
+    "reportBug": TicketCategory(name="Report Bug", emoji="🐛"),
+    "buyBusiness": TicketCategory(name="Buy a Business", emoji="💼"),
+    "buyEDM": TicketCategory(name="Buy EDMs", emoji="🏎️"),
+    "bookAuction": TicketCategory(name="Book an Auction Ticket", emoji="🎫"),
+    "other": TicketCategory(name="Other Issues", emoji="📝")
 }
 INACTIVE_CLOSE_DAYS = 3  # Close tickets after 3 days of inactivity
 ARCHIVE_DELETE_DAYS = 10  # Delete archived tickets after 10 days
+ACTIVITY_FLUSH_SECONDS = 5  # How often buffered ticket activity is written
+AUTO_CLOSE_CONCURRENCY = 10  # Inactive tickets closed in parallel per sweep
+ARCHIVE_DELETE_CONCURRENCY = 5  # Archived channels deleted in parallel per sweep
+RESTORE_VIEW_CONCURRENCY = 5  # Setup messages fetched in parallel when restoring views
+PASTEBIN_MAX_SIZE = 500_000  # Bytes; larger transcripts are attached to the channel instead
+
+
+# Queries run by the ticket handlers, kept as constants so asyncpg reuses cached statements
+_SQL_TRACK_USER = """
+INSERT INTO users (user_id, display_name, last_seen)
+VALUES ($1, $2, NOW())
+ON CONFLICT (user_id) DO UPDATE SET
+    display_name = EXCLUDED.display_name,
+    last_seen = EXCLUDED.last_seen
+"""
+
+_SQL_LOG_TICKET_STAT = """
+INSERT INTO ticket_stats (date, opened, closed, claimed)
+VALUES ($1, $2, $3, $4)
+ON CONFLICT (date) DO UPDATE SET
+    opened = ticket_stats.opened + EXCLUDED.opened,
+    closed = ticket_stats.closed + EXCLUDED.closed,
+    claimed = ticket_stats.claimed + EXCLUDED.claimed
+"""
+
+_SQL_OPEN_TICKET_BY_USER = """
+SELECT channel_id FROM tickets
+WHERE user_id = $1 AND closed = FALSE
+"""
+
+_SQL_INSERT_TICKET = """
+INSERT INTO tickets (channel_id, ticket_id, user_id, ticket_type, control_message_id)
+VALUES ($1, $2, $3, $4, $5)
+"""
+
+_SQL_TRANSCRIPT_HEADER = """
+SELECT ticket_id, user_id, ticket_type, created_at
+FROM tickets WHERE channel_id = $1
+"""
+
+_SQL_CLOSE_TICKET_BY_CHANNEL = """
+SELECT ticket_id, user_id, claimed_by, control_message_id
+FROM tickets
+WHERE channel_id = $1 AND closed = FALSE
+"""
+
+_SQL_CLAIM_TICKET_BY_CHANNEL = """
+SELECT channel_id, claimed_by, control_message_id FROM tickets
+WHERE channel_id = $1 AND closed = FALSE
+"""
+
+_SQL_CLAIM_TICKET = """
+UPDATE tickets
+SET claimed_by = $1, claimed_by_name = $2
+WHERE channel_id = $3
+"""
+
+_SQL_ADD_USER_CHECK = """
+SELECT ($1::bigint = user_id OR $1::bigint = ANY(additional_users)) AS present
+FROM tickets
+WHERE channel_id = $2 AND closed = FALSE
+"""
+
+_SQL_ADD_USER = """
+UPDATE tickets
+SET additional_users = array_append(additional_users, $1)
+WHERE channel_id = $2
+"""
+
+_SQL_REMOVE_USER_CHECK = """
+SELECT
+    $1::bigint = user_id AS is_creator,
+    $1::bigint = ANY(additional_users) AS present
+FROM tickets
+WHERE channel_id = $2 AND closed = FALSE
+"""
 
+_SQL_REMOVE_USER = """
+UPDATE tickets
+SET additional_users = array_remove(additional_users, $1)
+WHERE channel_id = $2
+"""
+
+_SQL_UPSERT_TRANSCRIPTS = """
+INSERT INTO transcripts (channel_id, paste_url, closed_by)
+VALUES ($1, $2, $3)
+ON CONFLICT (channel_id) DO UPDATE SET
+    paste_url = EXCLUDED.paste_url,
+    closed_at = NOW(),
+    closed_by = EXCLUDED.closed_by
+"""
+
+_SQL_CLOSE_TICKETS = """
+WITH closed AS (
+    UPDATE tickets
+    SET closed = TRUE
+    WHERE channel_id = ANY($1::bigint[]) AND closed = FALSE
+    RETURNING channel_id, ticket_id
+), archived AS (
+    INSERT INTO archived_tickets (channel_id, ticket_id, delete_at)
+    SELECT channel_id, ticket_id, $2 FROM closed
+    ON CONFLICT (channel_id) DO NOTHING
+)
+SELECT count(*) FROM closed
+"""
+
+_SQL_TOUCH_USERS = """
+INSERT INTO users (user_id, display_name, last_seen)
+SELECT user_id, display_name, NOW()
+FROM UNNEST($1::bigint[], $2::text[]) AS u(user_id, display_name)
+ON CONFLICT (user_id) DO UPDATE SET
+    display_name = EXCLUDED.display_name,
+    last_seen = EXCLUDED.last_seen
+"""
+
+_SQL_TOUCH_ACTIVITY = """
+UPDATE tickets
+SET last_activity = a.last_activity
+FROM UNNEST($1::bigint[], $2::timestamp[]) AS a(channel_id, last_activity)
+WHERE tickets.channel_id = a.channel_id
+"""
+
+# Schema and migrations, safe to run on every startup
+_SQL_BOOTSTRAP = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id BIGINT PRIMARY KEY,
+    display_name TEXT NOT NULL,
+    last_seen TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS tickets (
+    channel_id BIGINT PRIMARY KEY,
+    ticket_id TEXT NOT NULL UNIQUE,
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    ticket_type TEXT NOT NULL,
+    claimed_by BIGINT REFERENCES users(user_id),
+    claimed_by_name TEXT,
+    control_message_id BIGINT,
+    closed BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT NOW(),
+    last_activity TIMESTAMP DEFAULT NOW(),
+    additional_users BIGINT[] DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS transcripts (
+    channel_id BIGINT PRIMARY KEY REFERENCES tickets(channel_id),
+    paste_url TEXT,
+    closed_at TIMESTAMP DEFAULT NOW(),
+    closed_by BIGINT
+);
+
+CREATE TABLE IF NOT EXISTS ticket_stats (
+    date DATE PRIMARY KEY,
+    opened INTEGER DEFAULT 0,
+    closed INTEGER DEFAULT 0,
+    claimed INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS ticket_setups (
+    channel_id BIGINT PRIMARY KEY,
+    message_id BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS archived_tickets (
+    channel_id BIGINT PRIMARY KEY,
+    ticket_id TEXT NOT NULL,
+    delete_at TIMESTAMP NOT NULL
+);
+
+-- Inactive ticket sweep
+CREATE INDEX IF NOT EXISTS idx_tickets_open_last_activity
+    ON tickets(last_activity) WHERE closed = FALSE;
+
+-- Existing open ticket check on create
+CREATE INDEX IF NOT EXISTS idx_tickets_user_open
+    ON tickets(user_id) WHERE closed = FALSE;
+
+-- Archived ticket deletion sweep
+CREATE INDEX IF NOT EXISTS idx_archived_delete_at
+    ON archived_tickets(delete_at);
+
+-- Claimer name is stored on the ticket so /stats needs no JOIN
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS claimed_by_name TEXT;
+
+-- Control message ID lets handlers edit the buttons without a history scan
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS control_message_id BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_tickets_claimed_by
+    ON tickets(claimed_by) WHERE claimed_by IS NOT NULL;
+
+UPDATE tickets t SET claimed_by_name = u.display_name
+FROM users u
+WHERE t.claimed_by = u.user_id AND t.claimed_by IS NOT NULL AND t.claimed_by_name IS NULL;
+"""
 
 def generate_ticket_id():
-    """Generate a random ticket ID"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+    """Generate a random 8 character ticket ID (base32 of 40 random bits)"""
+    return base64.b32encode(os.urandom(5)).decode('ascii')
+
+# Built once, every TicketTypeSelect shares the same options
+_SELECT_OPTIONS = tuple(
+    discord.SelectOption(label=category.name, value=key, emoji=category.emoji)
+    for key, category in TICKET_CATEGORIES.items()
+)
 
 class TicketTypeSelect(Select):
     def __init__(self):
-        options = [
-            discord.SelectOption(
-                label=TICKET_CATEGORIES[category]["name"],
-                value=category,
-                emoji=TICKET_CATEGORIES[category]["emoji"]
-            ) for category in TICKET_CATEGORIES
-        ]
         super().__init__(
             placeholder="Select the type of ticket you want to create...",
             min_values=1,
             max_values=1,
-            options=options,
+            options=list(_SELECT_OPTIONS),
             custom_id="ticket_type_select"
         )
     
@@ -72,11 +310,31 @@ class TicketView(View):
 class TicketControlView(View):
     def __init__(self, is_staff: bool = False):
         super().__init__(timeout=None)
-        self.add_item(Button(label="Close Ticket", style=discord.ButtonStyle.red, custom_id="close_ticket"))
-        if is_staff:
-            self.add_item(Button(label="Claim Ticket", style=discord.ButtonStyle.blurple, custom_id="claim_ticket"))
-            self.add_item(Button(label="Add User", style=discord.ButtonStyle.green, custom_id="add_user"))
-            self.add_item(Button(label="Remove User", style=discord.ButtonStyle.gray, custom_id="remove_user"))
+        if not is_staff:
+            self.remove_item(self.claim_ticket)
+            self.remove_item(self.add_user)
+            self.remove_item(self.remove_user)
+    
+    @discord.ui.button(label="Close Ticket", style=discord.ButtonStyle.red, custom_id="close_ticket")
+    async def close_ticket(self, interaction: discord.Interaction, button: Button):
+        await handle_close_ticket(interaction)
+    
+    @discord.ui.button(label="Claim Ticket", style=discord.ButtonStyle.blurple, custom_id="claim_ticket")
+    async def claim_ticket(self, interaction: discord.Interaction, button: Button):
+        await handle_claim_ticket(interaction)
+    
+    @discord.ui.button(label="Add User", style=discord.ButtonStyle.green, custom_id="add_user")
+    async def add_user(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.send_modal(AddUserModal())
+    
+    @discord.ui.button(label="Remove User", style=discord.ButtonStyle.gray, custom_id="remove_user")
+    async def remove_user(self, interaction: discord.Interaction, button: Button):
+        await handle_remove_user_interaction(interaction)
+    
+    async def on_error(self, interaction: discord.Interaction, error: Exception, item):
+        log.error("Error handling %s", item.custom_id, exc_info=error)
+        if not interaction.response.is_done():
+            await interaction.response.send_message("An error occurred while processing your request.", ephemeral=True)
 
 class CloseReasonModal(Modal):
     def __init__(self):
@@ -121,10 +379,18 @@ class AddUserModal(Modal):
 async def create_db_pool():
     global pool
     try:
-        pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=10)
-        print("Database pool created successfully")
-    except Exception as e:
-        print(f"Error creating database pool: {e}")
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=PG_MIN_POOL,
+            max_size=PG_MAX_POOL,
+            max_inactive_connection_lifetime=300,
+            # The bot only runs a few dozen distinct statements
+            statement_cache_size=32,
+            max_cached_statement_lifetime=300
+        )
+        log.info("Database pool created successfully")
+    except Exception:
+        log.exception("Error creating database pool")
         raise
 
 async def init_db():
@@ -134,59 +400,42 @@ async def init_db():
     
     try:
         async with pool.acquire() as conn:
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                display_name TEXT NOT NULL,
-                last_seen TIMESTAMP DEFAULT NOW()
-            );
-            
-            CREATE TABLE IF NOT EXISTS tickets (
-                channel_id BIGINT PRIMARY KEY,
-                ticket_id TEXT NOT NULL UNIQUE,
-                user_id BIGINT NOT NULL REFERENCES users(user_id),
-                ticket_type TEXT NOT NULL,
-                claimed_by BIGINT REFERENCES users(user_id),
-                closed BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT NOW(),
-                last_activity TIMESTAMP DEFAULT NOW(),
-                additional_users BIGINT[] DEFAULT '{}'
-            );
-            
-            CREATE TABLE IF NOT EXISTS transcripts (
-                channel_id BIGINT PRIMARY KEY REFERENCES tickets(channel_id),
-                paste_url TEXT,
-                closed_at TIMESTAMP DEFAULT NOW(),
-                closed_by BIGINT
-            );
+            await conn.execute(_SQL_BOOTSTRAP)
             
-            CREATE TABLE IF NOT EXISTS ticket_stats (
-                date DATE PRIMARY KEY,
-                opened INTEGER DEFAULT 0,
-                closed INTEGER DEFAULT 0,
-                claimed INTEGER DEFAULT 0
-            );
-            
-            CREATE TABLE IF NOT EXISTS ticket_setups (
-                channel_id BIGINT PRIMARY KEY,
-                message_id BIGINT NOT NULL
-            );
-            
-            CREATE TABLE IF NOT EXISTS archived_tickets (
-                channel_id BIGINT PRIMARY KEY,
-                ticket_id TEXT NOT NULL,
-                delete_at TIMESTAMP NOT NULL
-            );
-            """)
-        print("Database initialized successfully")
-    except Exception as e:
-        print(f"Error initializing database: {e}")
+            open_tickets = await conn.fetch("SELECT channel_id FROM tickets WHERE closed = FALSE")
+        
+        OPEN_TICKET_CHANNELS.clear()
+        OPEN_TICKET_CHANNELS.update(row['channel_id'] for row in open_tickets)
+        log.info("Database initialized successfully")
+    except Exception:
+        log.exception("Error initializing database")
         raise
 
 async def startup():
-    """Initialize database connection and tables"""
+    """Initialize database connection, tables and HTTP session"""
+    global http_session
     await create_db_pool()
     await init_db()
+    # Created here so the session is bound to the running event loop
+    if http_session is None or http_session.closed:
+        # Keep-alive connections let repeated transcript uploads skip the TCP/TLS handshake
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=15)
+        )
+
+async def shutdown():
+    """Flush buffered activity and release the shared HTTP session"""
+    if pool is not None:
+        # Let a flush in progress commit instead of cancelling it, then write what's left
+        if flush_activity.is_running():
+            task = flush_activity.get_task()
+            flush_activity.stop()
+            await task
+        await flush_activity()
+    
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
 
 async def upload_to_pastebin(content: str) -> Optional[str]:
     """Upload transcript to Pastebin and return URL"""
@@ -200,113 +449,158 @@ async def upload_to_pastebin(content: str) -> Optional[str]:
             'api_paste_expire_date': '1M'  # 1 month expiration
         }
         
-        response = requests.post(
+        async with http_session.post(
             "https://pastebin.com/api/api_post.php",
-            data=data,
-            timeout=10
-        )
+            data=data
+        ) as response:
+            text = await response.text()
         
-        if response.status_code == 200 and response.text.startswith('http'):
-            return response.text
+        if response.status == 200 and text.startswith('http'):
+            return text
         return None
-    except Exception as e:
-        print(f"Error uploading to Pastebin: {e}")
+    except Exception:
+        log.exception("Error uploading to Pastebin")
         return None
 
+_FLATTEN_NEWLINES = str.maketrans({"\n": " "})
+
 async def create_transcript(channel: discord.TextChannel, closer: discord.Member) -> Optional[str]:
     """Create and upload a transcript of the ticket"""
-    transcript_content = []
+    # Lines are encoded as they stream in so buf.tell() is the size in bytes
+    buf = io.BytesIO()
     
     # Add header information
     async with pool.acquire() as conn:
-        ticket_info = await conn.fetchrow("""
-        SELECT ticket_id, user_id, ticket_type, created_at 
-        FROM tickets WHERE channel_id = $1
-        """, channel.id)
-    
-    transcript_content.append(f"=== TICKET TRANSCRIPT ===")
-    transcript_content.append(f"Ticket ID: {ticket_info['ticket_id']}")
-    transcript_content.append(f"Created by: {channel.guild.get_member(ticket_info['user_id']) or ticket_info['user_id']}")
-    transcript_content.append(f"Type: {ticket_info['ticket_type']}")
-    transcript_content.append(f"Created at: {ticket_info['created_at']}")
-    transcript_content.append(f"Closed at: {datetime.now()}")
-    transcript_content.append(f"Closed by: {closer}")
-    transcript_content.append("\n=== MESSAGES ===\n")
+        ticket_info = await conn.fetchrow(_SQL_TRANSCRIPT_HEADER, channel.id)
+    
+    buf.write((
+        f"=== TICKET TRANSCRIPT ===\n"
+        f"Ticket ID: {ticket_info['ticket_id']}\n"
+        f"Created by: {channel.guild.get_member(ticket_info['user_id']) or ticket_info['user_id']}\n"
+        f"Type: {ticket_info['ticket_type']}\n"
+        f"Created at: {ticket_info['created_at']}\n"
+        f"Closed at: {datetime.now()}\n"
+        f"Closed by: {closer}\n"
+        f"\n=== MESSAGES ===\n\n"
+    ).encode())
     
     # Fetch and format all messages
     async for message in channel.history(limit=None, oldest_first=True):
-        timestamp = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        author = message.author.display_name
-        content = message.clean_content.replace('\n', ' ')
-        
         # Handle attachments
         attachments = ""
         if message.attachments:
             attachments = " [Attachments: " + ", ".join(a.filename for a in message.attachments) + "]"
         
-        transcript_content.append(f"[{timestamp}] {author}: {content}{attachments}")
+        buf.write((
+            f"[{message.created_at:%Y-%m-%d %H:%M:%S}] {message.author.display_name}: "
+            f"{message.clean_content.translate(_FLATTEN_NEWLINES)}{attachments}\n"
+        ).encode())
+    
+    # Too large for Pastebin, attach it to the ticket channel instead
+    if buf.tell() > PASTEBIN_MAX_SIZE:
+        buf.seek(0)
+        transcript_file = discord.File(buf, filename=f"transcript-{ticket_info['ticket_id']}.txt")
+        try:
+            transcript_msg = await channel.send(file=transcript_file)
+        except discord.HTTPException:
+            log.exception("Error attaching transcript to channel %s", channel.id)
+            return None
+        # Attachment CDN links expire; the message link lasts as long as the archived channel
+        return transcript_msg.jump_url
     
     # Upload to Pastebin
-    paste_url = await upload_to_pastebin("\n".join(transcript_content))
+    return await upload_to_pastebin(buf.getvalue().decode())
+
+async def archive_tickets(tickets: List[tuple], closed_by: int):
+    """Store transcripts, mark tickets closed and schedule deletion in one transaction
     
-    # Store reference in database
-    if paste_url:
-        async with pool.acquire() as conn:
-            await conn.execute("""
-            INSERT INTO transcripts (channel_id, paste_url, closed_by)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (channel_id) DO UPDATE SET
-                paste_url = EXCLUDED.paste_url,
-                closed_at = NOW(),
-                closed_by = EXCLUDED.closed_by
-            """, channel.id, paste_url, closer.id)
-    
-    return paste_url
-
-async def track_user(member: discord.Member):
-    """Update user information in database"""
+    ``tickets`` is a list of ``(channel_id, paste_url)`` tuples.
+    """
+    delete_at = datetime.now() + timedelta(days=ARCHIVE_DELETE_DAYS)
     async with pool.acquire() as conn:
-        await conn.execute("""
-        INSERT INTO users (user_id, display_name, last_seen)
-        VALUES ($1, $2, NOW())
-        ON CONFLICT (user_id) DO UPDATE SET
-            display_name = EXCLUDED.display_name,
-            last_seen = EXCLUDED.last_seen
-        """, member.id, member.display_name)
-
-async def log_ticket_stat(action: str):
-    """Log ticket statistics"""
+        async with conn.transaction():
+            transcripts = [
+                (channel_id, paste_url, closed_by)
+                for channel_id, paste_url in tickets if paste_url
+            ]
+            if transcripts:
+                await conn.executemany(_SQL_UPSERT_TRANSCRIPTS, transcripts)
+            
+            # Close and schedule for deletion in one statement; tickets closed
+            # elsewhere in the meantime are skipped and not counted again
+            closed_count = await conn.fetchval(
+                _SQL_CLOSE_TICKETS, [channel_id for channel_id, _ in tickets], delete_at
+            )
+            
+            if closed_count:
+                await log_ticket_stat("closed", conn, count=closed_count)
+    
+    OPEN_TICKET_CHANNELS.difference_update(channel_id for channel_id, _ in tickets)
+
+async def track_user(member: discord.Member, conn: Optional[asyncpg.Connection] = None):
+    """Update user information in database, optionally on an already acquired connection"""
+    if conn is None:
+        async with pool.acquire() as conn:
+            return await track_user(member, conn)
+    
+    await conn.execute(_SQL_TRACK_USER, member.id, member.display_name)
+
+async def log_ticket_stat(action: str, conn: Optional[asyncpg.Connection] = None, count: int = 1):
+    """Log ticket statistics, optionally on an already acquired connection"""
+    if conn is None:
+        async with pool.acquire() as conn:
+            return await log_ticket_stat(action, conn, count)
+    
     today = datetime.now().date()
-    async with pool.acquire() as conn:
-        await conn.execute("""
-        INSERT INTO ticket_stats (date, opened, closed, claimed)
-        VALUES ($1, $2, $3, $4)
-        ON CONFLICT (date) DO UPDATE SET
-            opened = ticket_stats.opened + EXCLUDED.opened,
-            closed = ticket_stats.closed + EXCLUDED.closed,
-            claimed = ticket_stats.claimed + EXCLUDED.claimed
-        """, today, 
-           1 if action == "opened" else 0,
-           1 if action == "closed" else 0,
-           1 if action == "claimed" else 0)
+    await conn.execute(
+        _SQL_LOG_TICKET_STAT, today,
+        count if action == "opened" else 0,
+        count if action == "closed" else 0,
+        count if action == "claimed" else 0
+    )
 
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user.name} ({bot.user.id})')
-    print('------')
+    log.info("Logged in as %s (%s)", bot.user.name, bot.user.id)
     try:
         await startup()
-        print(f'Logged in as {bot.user} (ID: {bot.user.id})')
-    except Exception as e:
-        print(f"Failed to initialize: {e}")
+        log.info("Startup complete for %s (ID: %s)", bot.user, bot.user.id)
+    except Exception:
+        log.exception("Failed to initialize")
         
+    refresh_staff_role_ids()
     await bot.tree.sync()
     auto_close_tickets.start()
     delete_archived_tickets.start()
+    flush_activity.start()
     await restore_ticket_views()
 
+def refresh_staff_role_ids():
+    """Resolve the IDs of all roles named in STAFF_ROLES"""
+    STAFF_ROLE_IDS.clear()
+    STAFF_ROLE_IDS.update(
+        role.id for guild in bot.guilds for role in guild.roles if role.name in STAFF_ROLES
+    )
+
+@bot.event
+async def on_guild_join(guild):
+    refresh_staff_role_ids()
+
+@bot.event
+async def on_guild_role_create(role):
+    refresh_staff_role_ids()
+
+@bot.event
+async def on_guild_role_delete(role):
+    refresh_staff_role_ids()
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name:
+        refresh_staff_role_ids()
+
 def is_staff(member: discord.Member):
-    return any(role.name in STAFF_ROLES for role in member.roles)
+    return any(role.id in STAFF_ROLE_IDS for role in member.roles)
 
 @bot.hybrid_command()
 @commands.has_permissions(manage_guild=True)
@@ -324,42 +618,48 @@ async def stats(ctx, timeframe: str = "day"):
         return
     
     days = timeframes[timeframe]
-    date_filter = "AND date >= CURRENT_DATE - INTERVAL '%s days'" % days if days > 0 else ""
     
     async with pool.acquire() as conn:
-        # Get overall stats
-        stats = await conn.fetchrow(f"""
-        SELECT 
-            SUM(opened) as total_opened,
-            SUM(closed) as total_closed,
-            SUM(claimed) as total_claimed,
-            AVG(closed::float/NULLIF(opened, 0)) as close_rate
-        FROM ticket_stats
-        WHERE 1=1 {date_filter}
-        """)
-        
-        # Get recent activity
-        recent = await conn.fetch(f"""
-        SELECT date, opened, closed, claimed 
-        FROM ticket_stats 
-        WHERE 1=1 {date_filter}
-        ORDER BY date DESC
-        LIMIT 30
-        """)
-        
-        # Get staff claims
-        staff_claims = await conn.fetch("""
-        SELECT 
-            t.claimed_by,
-            COUNT(*) as claims,
-            u.display_name
-        FROM tickets t
-        JOIN users u ON t.claimed_by = u.user_id
-        WHERE t.claimed_by IS NOT NULL
-        GROUP BY t.claimed_by, u.display_name
-        ORDER BY claims DESC
-        LIMIT 5
-        """)
+        # Overview, recent activity and top staff in a single round-trip
+        # $1 = 0 means no date limit; keeping days a parameter lets the statement be cached
+        row = await conn.fetchrow("""
+        WITH overview AS (
+            SELECT 
+                SUM(opened) as total_opened,
+                SUM(closed) as total_closed,
+                SUM(claimed) as total_claimed,
+                AVG(closed::float/NULLIF(opened, 0)) as close_rate
+            FROM ticket_stats
+            WHERE $1::int = 0 OR date >= CURRENT_DATE - $1::int
+        ),
+        recent AS (
+            SELECT date, opened, closed, claimed 
+            FROM ticket_stats 
+            WHERE $1::int = 0 OR date >= CURRENT_DATE - $1::int
+            ORDER BY date DESC
+            LIMIT 30
+        ),
+        top_staff AS (
+            SELECT 
+                claimed_by,
+                COUNT(*) as claims,
+                MAX(claimed_by_name) as display_name
+            FROM tickets
+            WHERE claimed_by IS NOT NULL
+            GROUP BY claimed_by
+            ORDER BY claims DESC
+            LIMIT 5
+        )
+        SELECT
+            (SELECT row_to_json(o) FROM overview o) AS overview,
+            (SELECT json_agg(r ORDER BY r.date DESC) FROM recent r) AS recent,
+            (SELECT json_agg(s ORDER BY s.claims DESC) FROM top_staff s) AS staff
+        """, days)
+    
+    # asyncpg returns json columns as text; json_agg over no rows is NULL
+    stats = json.loads(row['overview'])
+    recent = json.loads(row['recent'] or '[]')
+    staff_claims = json.loads(row['staff'] or '[]')
     
     # Create embed
     embed = discord.Embed(
@@ -381,7 +681,7 @@ async def stats(ctx, timeframe: str = "day"):
     if recent:
         recent_days = min(5, len(recent))
         recent_text = "\n".join(
-            f"{row['date'].strftime('%b %d')}: +{row['opened']} / -{row['closed']}"
+            f"{date.fromisoformat(row['date']).strftime('%b %d')}: +{row['opened']} / -{row['closed']}"
             for row in recent[:recent_days]
         )
         embed.add_field(
@@ -409,22 +709,16 @@ async def stats(ctx, timeframe: str = "day"):
 async def userstats(ctx, user: discord.Member):
     """View ticket statistics for a specific user"""
     async with pool.acquire() as conn:
-        # As ticket creator
-        created = await conn.fetchrow("""
-        SELECT 
-            COUNT(*) as total,
-            SUM(CASE WHEN closed = TRUE THEN 1 ELSE 0 END) as closed
-        FROM tickets
-        WHERE user_id = $1
-        """, user.id)
-        
-        # As staff member
-        staff = await conn.fetchrow("""
+        # As ticket creator and as staff member in one pass
+        user_stats = await conn.fetchrow("""
         SELECT 
-            COUNT(*) as claimed,
-            AVG(EXTRACT(EPOCH FROM (last_activity - created_at))/3600) as avg_hours
+            COUNT(*) FILTER (WHERE user_id = $1) as total,
+            COUNT(*) FILTER (WHERE user_id = $1 AND closed = TRUE) as closed,
+            COUNT(*) FILTER (WHERE claimed_by = $1 AND closed = TRUE) as claimed,
+            AVG(EXTRACT(EPOCH FROM (last_activity - created_at))/3600)
+                FILTER (WHERE claimed_by = $1 AND closed = TRUE) as avg_hours
         FROM tickets
-        WHERE claimed_by = $1 AND closed = TRUE
+        WHERE user_id = $1 OR claimed_by = $1
         """, user.id)
     
     embed = discord.Embed(
@@ -435,9 +729,9 @@ async def userstats(ctx, user: discord.Member):
     # Created tickets
     embed.add_field(
         name="🎫 Created Tickets",
-        value=f"**Total:** {created['total'] or 0}\n"
-              f"**Closed:** {created['closed'] or 0}\n"
-              f"**Open:** {created['total'] - created['closed']}",
+        value=f"**Total:** {user_stats['total']}\n"
+              f"**Closed:** {user_stats['closed']}\n"
+              f"**Open:** {user_stats['total'] - user_stats['closed']}",
         inline=True
     )
     
@@ -445,8 +739,8 @@ async def userstats(ctx, user: discord.Member):
     if is_staff(user):
         embed.add_field(
             name="🛠️ Staff Activity",
-            value=f"**Claimed:** {staff['claimed'] or 0}\n"
-                  f"**Avg Time:** {staff['avg_hours']:.1f} hours" if staff['avg_hours'] else "No data",
+            value=f"**Claimed:** {user_stats['claimed']}\n"
+                  f"**Avg Time:** {user_stats['avg_hours']:.1f} hours" if user_stats['avg_hours'] else "No data",
             inline=True
         )
     
@@ -501,88 +795,105 @@ async def setup(ctx):
             message_id = EXCLUDED.message_id
         """, ctx.channel.id, message.id)
 
-async def restore_ticket_views():
-    """Restore ticket setup views after bot restart"""
+async def restore_ticket_views(guild: Optional[discord.Guild] = None):
+    """Restore ticket setup views after bot restart, or only lost views in one guild"""
     async with pool.acquire() as conn:
         setups = await conn.fetch("SELECT channel_id, message_id FROM ticket_setups")
+    
+    sem = asyncio.Semaphore(RESTORE_VIEW_CONCURRENCY)
+    
+    async def restore_one(setup):
+        """Returns the channel ID if the setup message no longer exists"""
+        if guild:
+            channel = guild.get_channel(setup['channel_id'])
+        else:
+            channel = bot.get_channel(setup['channel_id'])
+        if not channel:
+            return None
         
-    for setup in setups:
-        channel = bot.get_channel(setup['channel_id'])
-        if channel:
+        async with sem:
             try:
                 message = await channel.fetch_message(setup['message_id'])
-                await message.edit(view=TicketView())
+                # After a restart every view must be re-attached, otherwise only lost ones
+                if guild is None or not message.components:
+                    await message.edit(view=TicketView())
             except discord.NotFound:
-                # Message was deleted, remove from database
-                async with pool.acquire() as conn:
-                    await conn.execute("DELETE FROM ticket_setups WHERE channel_id = $1", setup['channel_id'])
-            except Exception as e:
-                print(f"Error restoring ticket view in channel {setup['channel_id']}: {e}")
+                return setup['channel_id']
+            except Exception:
+                log.exception("Error restoring ticket view in channel %s", setup['channel_id'])
+        return None
+    
+    results = await asyncio.gather(*(restore_one(setup) for setup in setups))
+    
+    # Messages were deleted, remove them from database
+    missing = [channel_id for channel_id in results if channel_id]
+    if missing:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM ticket_setups WHERE channel_id = ANY($1::bigint[])", missing)
+
+async def get_category(guild: discord.Guild, name: str, staff_only: bool = False) -> discord.CategoryChannel:
+    """Get a category by name, creating it if missing. IDs are cached per guild."""
+    key = (guild.id, name)
+    category_id = _category_ids.get(key)
+    category = guild.get_channel(category_id) if category_id else None
+    
+    if category is None:
+        category = discord.utils.get(guild.categories, name=name)
+        if category is None:
+            overwrites = {}
+            if staff_only:
+                # New category is hidden from everyone but staff
+                overwrites[guild.default_role] = discord.PermissionOverwrite(read_messages=False)
+                for role in guild.roles:
+                    if role.name in STAFF_ROLES:
+                        overwrites[role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+            category = await guild.create_category(name, overwrites=overwrites)
+        _category_ids[key] = category.id
+    
+    return category
 
 async def create_ticket(interaction: discord.Interaction, ticket_type: str):
-    await track_user(interaction.user)
     guild = interaction.guild
     user = interaction.user
     
     try:
-        # Check for existing open tickets
+        # Update user info and check for existing open tickets
         async with pool.acquire() as conn:
-            existing = await conn.fetchrow("""
-            SELECT channel_id FROM tickets 
-            WHERE user_id = $1 AND closed = FALSE
-            """, user.id)
-            
-            if existing:
-                channel = guild.get_channel(existing['channel_id'])
-                if channel:
-                    await interaction.followup.send(
-                        f"You already have an open ticket: {channel.mention}", 
-                        ephemeral=True
-                    )
-                    return
+            await track_user(user, conn)
+            existing = await conn.fetchrow(_SQL_OPEN_TICKET_BY_USER, user.id)
+        
+        if existing:
+            channel = guild.get_channel(existing['channel_id'])
+            if channel:
+                await interaction.followup.send(
+                    f"You already have an open ticket: {channel.mention}", 
+                    ephemeral=True
+                )
+                return
         
         # Generate ticket ID
         ticket_id = generate_ticket_id()
         
         # Get or create category for this ticket type
-        category_name = TICKET_CATEGORIES[ticket_type]["name"]
-        ticket_category = discord.utils.get(guild.categories, name=category_name)
+        category = TICKET_CATEGORIES[ticket_type]
+        ticket_category = await get_category(guild, category.name, staff_only=True)
         
-        if not ticket_category:
-            # Create new category with customized permissions
-            ticket_category = await guild.create_category(category_name)
-            
-            # Set category permissions
-            await ticket_category.set_permissions(guild.default_role, read_messages=False)
-            
-            # Add staff permissions
-            for role in guild.roles:
-                if role.name in STAFF_ROLES:
-                    await ticket_category.set_permissions(role, read_messages=True, send_messages=True)
+        # Channel inherits the category permissions plus access for the ticket creator
+        channel_overwrites = dict(ticket_category.overwrites)
+        channel_overwrites[guild.default_role] = discord.PermissionOverwrite(read_messages=False)
+        channel_overwrites[user] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
         
         # Create ticket channel with ticket ID
         ticket_channel = await guild.create_text_channel(
             name=f"ticket-{ticket_id}",
             category=ticket_category,
-            topic=f"Ticket ID: {ticket_id} | Type: {TICKET_CATEGORIES[ticket_type]['name']}"
+            overwrites=channel_overwrites,
+            topic=f"Ticket ID: {ticket_id} | Type: {category.name}"
         )
         
-        # Set channel permissions
-        await ticket_channel.set_permissions(guild.default_role, read_messages=False)
-        await ticket_channel.set_permissions(user, read_messages=True, send_messages=True)
-        
-        # Store ticket info
-        async with pool.acquire() as conn:
-            await conn.execute("""
-            INSERT INTO tickets (channel_id, ticket_id, user_id, ticket_type)
-            VALUES ($1, $2, $3, $4)
-            """, ticket_channel.id, ticket_id, user.id, ticket_type)
-        
-        await log_ticket_stat("opened")
-        
         # Send welcome message
         embed = discord.Embed(
-            title=f"{TICKET_CATEGORIES[ticket_type]['emoji']} {TICKET_CATEGORIES[ticket_type]['name']} Ticket",
+            title=f"{category.emoji} {category.name} Ticket",
             description=f"Thank you for creating a ticket, {user.mention}!\n\n"
                        f"**Ticket ID:** {ticket_id}\n"
                        f"Support staff will be with you shortly.\n\n"
@@ -600,14 +911,26 @@ async def create_ticket(interaction: discord.Interaction, ticket_type: str):
         # Pin the control message
         await control_msg.pin()
         
+        # Store ticket info, including the control message sent above
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    _SQL_INSERT_TICKET,
+                    ticket_channel.id, ticket_id, user.id, ticket_type, control_msg.id
+                )
+                
+                await log_ticket_stat("opened", conn)
+        
+        OPEN_TICKET_CHANNELS.add(ticket_channel.id)
+        
         await interaction.followup.send(
-            f"Your {TICKET_CATEGORIES[ticket_type]['name']} ticket has been created: {ticket_channel.mention}\n"
+            f"Your {category.name} ticket has been created: {ticket_channel.mention}\n"
             f"**Ticket ID:** {ticket_id}", 
             ephemeral=True
         )
     
-    except Exception as e:
-        print(f"Error creating ticket: {e}")
+    except Exception:
+        log.exception("Error creating ticket")
         if not interaction.response.is_done():
             await interaction.followup.send(
                 "An error occurred while creating your ticket. Please try again.",
@@ -626,17 +949,27 @@ async def auto_close_tickets():
         WHERE closed = FALSE AND last_activity < $1
         """, cutoff)
     
-    for ticket in inactive_tickets:
-        guild = bot.get_guild(bot.guilds[0].id)  # Get first guild - adjust as needed
-        channel = guild.get_channel(ticket['channel_id'])
-        user = guild.get_member(ticket['user_id'])
-        
-        if channel:
+    if not inactive_tickets:
+        return
+    
+    guild = bot.get_guild(bot.guilds[0].id)  # Get first guild - adjust as needed
+    reason = f"Automatically closed after {INACTIVE_CLOSE_DAYS} days of inactivity"
+    
+    # Resolve the archive category once so concurrent closes don't each create one
+    archive_category = await get_category(guild, "Archived Tickets")
+    
+    sem = asyncio.Semaphore(AUTO_CLOSE_CONCURRENCY)
+    
+    async def close_one(ticket):
+        async with sem:
+            channel = guild.get_channel(ticket['channel_id'])
+            if not channel:
+                return None
+            
             # Create transcript
             paste_url = await create_transcript(channel, bot.user)
             
             # Send closure message
-            reason = f"Automatically closed after {INACTIVE_CLOSE_DAYS} days of inactivity"
             embed = discord.Embed(
                 title="Ticket Closed Due to Inactivity",
                 description=f"This ticket has been {reason}\n\n"
@@ -659,35 +992,32 @@ async def auto_close_tickets():
                     )
                     await creator.send(embed=dm_embed)
             except discord.Forbidden:
-                print(f"Could not send DM to user {ticket['user_id']}")
+                log.warning("Could not send DM to user %s", ticket['user_id'])
             
             # Archive channel
-            archive_category = discord.utils.get(guild.categories, name="Archived Tickets")
-            if not archive_category:
-                archive_category = await guild.create_category("Archived Tickets")
-            
             await channel.edit(category=archive_category)
             await channel.set_permissions(
                 guild.default_role,
                 read_messages=False
             )
             
-            # Update database
-            async with pool.acquire() as conn:
-                await conn.execute("""
-                UPDATE tickets 
-                SET closed = TRUE 
-                WHERE channel_id = $1
-                """, channel.id)
-                
-                # Schedule for deletion
-                delete_at = datetime.now() + timedelta(days=ARCHIVE_DELETE_DAYS)
-                await conn.execute("""
-                INSERT INTO archived_tickets (channel_id, ticket_id, delete_at)
-                VALUES ($1, $2, $3)
-                """, channel.id, ticket['ticket_id'], delete_at)
-            
-            await log_ticket_stat("closed")
+            return (channel.id, paste_url)
+    
+    results = await asyncio.gather(
+        *(close_one(ticket) for ticket in inactive_tickets),
+        return_exceptions=True
+    )
+    
+    closed = []
+    for ticket, result in zip(inactive_tickets, results):
+        if isinstance(result, Exception):
+            log.error("Error auto-closing ticket %s", ticket['ticket_id'], exc_info=result)
+        elif result:
+            closed.append(result)
+    
+    # Update database for every closed ticket at once
+    if closed:
+        await archive_tickets(closed, bot.user.id)
 
 @tasks.loop(hours=6)
 async def delete_archived_tickets():
@@ -698,39 +1028,111 @@ async def delete_archived_tickets():
         WHERE delete_at <= NOW()
         """)
         
-    for ticket in tickets_to_delete:
+    if not tickets_to_delete:
+        return
+    
+    sem = asyncio.Semaphore(ARCHIVE_DELETE_CONCURRENCY)
+    
+    async def delete_one(ticket):
         channel = bot.get_channel(ticket['channel_id'])
         if channel:
-            try:
-                await channel.delete()
-            except discord.NotFound:
-                pass  # Channel already deleted
-            except Exception as e:
-                print(f"Error deleting archived ticket channel {ticket['channel_id']}: {e}")
-        
-        # Clean up database
+            async with sem:
+                try:
+                    await channel.delete()
+                except discord.NotFound:
+                    pass  # Channel already deleted
+                except Exception:
+                    log.exception("Error deleting archived ticket channel %s", ticket['channel_id'])
+                    return False
+        return True
+    
+    results = await asyncio.gather(*(delete_one(ticket) for ticket in tickets_to_delete))
+    deleted = [ticket for ticket, ok in zip(tickets_to_delete, results) if ok]
+    if not deleted:
+        return
+    
+    # Clean up database, failed channels stay scheduled for the next run
+    channel_ids = [ticket['channel_id'] for ticket in deleted]
+    try:
         async with pool.acquire() as conn:
-            await conn.execute("DELETE FROM archived_tickets WHERE channel_id = $1", ticket['channel_id'])
-            await conn.execute("DELETE FROM tickets WHERE ticket_id = $1", ticket['ticket_id'])
+            async with conn.transaction():
+                await conn.execute(
+                    "DELETE FROM archived_tickets WHERE channel_id = ANY($1::bigint[])",
+                    channel_ids
+                )
+                # Transcripts reference tickets, remove them first
+                await conn.execute(
+                    "DELETE FROM transcripts WHERE channel_id = ANY($1::bigint[])",
+                    channel_ids
+                )
+                await conn.execute(
+                    "DELETE FROM tickets WHERE ticket_id = ANY($1::text[])",
+                    [ticket['ticket_id'] for ticket in deleted]
+                )
+    except Exception:
+        # Keep the loop alive, the rows are retried on the next sweep
+        log.exception("Error cleaning up archived tickets")
 
-async def restore_ticket_creation_view(guild: discord.Guild):
-    """Restore the ticket creation view in setup channels"""
-    async with pool.acquire() as conn:
-        setups = await conn.fetch("SELECT channel_id, message_id FROM ticket_setups")
-        
-    for setup in setups:
-        channel = guild.get_channel(setup['channel_id'])
-        if channel:
-            try:
-                message = await channel.fetch_message(setup['message_id'])
-                if not message.components:  # If view was lost
-                    await message.edit(view=TicketView())
-            except discord.NotFound:
-                # Message was deleted, remove from database
-                async with pool.acquire() as conn:
-                    await conn.execute("DELETE FROM ticket_setups WHERE channel_id = $1", setup['channel_id'])
-            except Exception as e:
-                print(f"Error restoring ticket view in channel {setup['channel_id']}: {e}")
+@tasks.loop(seconds=ACTIVITY_FLUSH_SECONDS)
+async def flush_activity():
+    """Write buffered ticket activity and message authors in one batch"""
+    global _activity_buf, _seen_users
+    if not _activity_buf and not _seen_users:
+        return
+    
+    activity, _activity_buf = _activity_buf, {}
+    users, _seen_users = _seen_users, {}
+    
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if users:
+                    await conn.execute(_SQL_TOUCH_USERS, list(users.keys()), list(users.values()))
+                
+                if activity:
+                    await conn.execute(_SQL_TOUCH_ACTIVITY, list(activity.keys()), list(activity.values()))
+    except Exception:
+        log.exception("Error flushing ticket activity")
+        # Put the batch back for the next flush, newer entries take precedence
+        for channel_id, last_activity in activity.items():
+            _activity_buf.setdefault(channel_id, last_activity)
+        for user_id, display_name in users.items():
+            _seen_users.setdefault(user_id, display_name)
+
+def run_in_background(coro, description: str):
+    """Schedule a coroutine without awaiting it, logging any error it raises"""
+    async def runner():
+        try:
+            await coro
+        except Exception:
+            log.exception("Error %s", description)
+    
+    task = asyncio.create_task(runner())
+    # Keep a reference until the task finishes so it isn't garbage collected
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def send_dm(member: discord.Member, embed: discord.Embed):
+    """DM a member, skipping members who don't accept DMs"""
+    try:
+        await member.send(embed=embed)
+    except discord.Forbidden:
+        log.warning("Could not send DM to user %s", member.id)
+
+async def edit_control_message(channel: discord.TextChannel, message_id: Optional[int], view: Optional[View]):
+    """Replace the buttons on a ticket's control message"""
+    if message_id:
+        try:
+            await channel.get_partial_message(message_id).edit(view=view)
+        except discord.NotFound:
+            pass  # Control message was deleted
+        return
+    
+    # Tickets created before control_message_id was stored
+    async for message in channel.history(limit=10):
+        if message.components:
+            await message.edit(view=view)
+            break
 
 async def handle_close_ticket(interaction: discord.Interaction):
     channel = interaction.channel
@@ -739,99 +1141,76 @@ async def handle_close_ticket(interaction: discord.Interaction):
     try:
         # Get ticket info
         async with pool.acquire() as conn:
-            ticket = await conn.fetchrow("""
-            SELECT ticket_id, user_id, claimed_by 
-            FROM tickets 
-            WHERE channel_id = $1 AND closed = FALSE
-            """, channel.id)
-            
-            if not ticket:
-                await interaction.response.send_message("This is not an open ticket channel.", ephemeral=True)
-                return
+            ticket = await conn.fetchrow(_SQL_CLOSE_TICKET_BY_CHANNEL, channel.id)
             
-            if not (is_staff(user) or user.id == ticket['user_id']):
-                await interaction.response.send_message("You don't have permission to close this ticket.", ephemeral=True)
-                return
+        if not ticket:
+            await interaction.response.send_message("This is not an open ticket channel.", ephemeral=True)
+            return
+        
+        if not (is_staff(user) or user.id == ticket['user_id']):
+            await interaction.response.send_message("You don't have permission to close this ticket.", ephemeral=True)
+            return
 
-            # Ask for closure reason if staff is closing
-            reason = "No reason provided"
-            if is_staff(user):
-                modal = CloseReasonModal()
-                await interaction.response.send_modal(modal)
-                await modal.wait()
-                reason = modal.reason.value
-            else:
-                await interaction.response.defer()
+        # Ask for closure reason if staff is closing
+        reason = "No reason provided"
+        if is_staff(user):
+            modal = CloseReasonModal()
+            await interaction.response.send_modal(modal)
+            await modal.wait()
+            reason = modal.reason.value
+        else:
+            await interaction.response.defer()
 
-            # Create transcript
-            paste_url = await create_transcript(channel, user)
-            
-            # Create closure embed
-            embed = discord.Embed(
-                title="Ticket Closed",
-                description=f"This ticket has been closed by {user.mention}\n\n"
+        # Create transcript
+        paste_url = await create_transcript(channel, user)
+        
+        # Create closure embed
+        embed = discord.Embed(
+            title="Ticket Closed",
+            description=f"This ticket has been closed by {user.mention}\n\n"
+                       f"**Ticket ID:** {ticket['ticket_id']}\n"
+                       f"**Reason:** {reason}\n"
+                       f"**Transcript:** {paste_url or 'Not available'}",
+            color=discord.Color.red()
+        )
+        
+        # Send to ticket channel
+        await channel.send(embed=embed)
+        
+        # Send DM to ticket creator without holding up the close
+        creator = interaction.guild.get_member(ticket['user_id'])
+        if creator:
+            dm_embed = discord.Embed(
+                title="Your Ticket Has Been Closed",
+                description=f"Your ticket in {interaction.guild.name} has been closed\n\n"
                            f"**Ticket ID:** {ticket['ticket_id']}\n"
                            f"**Reason:** {reason}\n"
                            f"**Transcript:** {paste_url or 'Not available'}",
                 color=discord.Color.red()
             )
-            
-            # Send to ticket channel
-            await channel.send(embed=embed)
-            
-            # Send DM to ticket creator
-            try:
-                creator = interaction.guild.get_member(ticket['user_id'])
-                if creator:
-                    dm_embed = discord.Embed(
-                        title="Your Ticket Has Been Closed",
-                        description=f"Your ticket in {interaction.guild.name} has been closed\n\n"
-                                   f"**Ticket ID:** {ticket['ticket_id']}\n"
-                                   f"**Reason:** {reason}\n"
-                                   f"**Transcript:** {paste_url or 'Not available'}",
-                        color=discord.Color.red()
-                    )
-                    await creator.send(embed=dm_embed)
-            except discord.Forbidden:
-                print(f"Could not send DM to user {ticket['user_id']}")
-            
-            # Archive channel
-            archive_category = discord.utils.get(interaction.guild.categories, name="Archived Tickets")
-            if not archive_category:
-                archive_category = await interaction.guild.create_category("Archived Tickets")
-            
-            await channel.edit(category=archive_category)
-            await channel.set_permissions(
+            run_in_background(send_dm(creator, dm_embed), f"sending close DM to user {creator.id}")
+        
+        # Archive channel
+        archive_category = await get_category(interaction.guild, "Archived Tickets")
+        
+        await asyncio.gather(
+            channel.edit(category=archive_category),
+            channel.set_permissions(
                 interaction.guild.default_role,
                 read_messages=False
             )
-            
-            # Update database
-            await conn.execute("""
-            UPDATE tickets 
-            SET closed = TRUE 
-            WHERE channel_id = $1
-            """, channel.id)
-            
-            # Schedule for deletion
-            delete_at = datetime.now() + timedelta(days=ARCHIVE_DELETE_DAYS)
-            await conn.execute("""
-            INSERT INTO archived_tickets (channel_id, ticket_id, delete_at)
-            VALUES ($1, $2, $3)
-            """, channel.id, ticket['ticket_id'], delete_at)
-            
-            await log_ticket_stat("closed")
-            
-            # Remove buttons from control message
-            async for message in channel.history(limit=10):
-                if message.components:
-                    await message.edit(view=None)
-                    break
-            
-            await restore_ticket_creation_view(interaction.guild)
+        )
+        
+        # Update database
+        await archive_tickets([(channel.id, paste_url)], user.id)
+        
+        # Remove buttons from control message
+        await edit_control_message(channel, ticket['control_message_id'], None)
+        
+        run_in_background(restore_ticket_views(interaction.guild), "restoring ticket views")
 
-    except Exception as e:
-        print(f"Error closing ticket: {type(e).__name__}: {e}")
+    except Exception:
+        log.exception("Error closing ticket")
         if not interaction.response.is_done():
             await interaction.response.send_message(
                 "An error occurred while closing the ticket. Please try again.",
@@ -839,19 +1218,17 @@ async def handle_close_ticket(interaction: discord.Interaction):
             )
 
 async def handle_claim_ticket(interaction: discord.Interaction):
-    await track_user(interaction.user)
     """Handle ticket claiming via interaction"""
-    if not is_staff(interaction.user):
+    await track_user(interaction.user)
+    is_staff_user = is_staff(interaction.user)
+    if not is_staff_user:
         await interaction.response.send_message("You don't have permission to claim tickets.", ephemeral=True)
         return
     
     channel = interaction.channel
     
     async with pool.acquire() as conn:
-        ticket = await conn.fetchrow("""
-        SELECT channel_id, claimed_by FROM tickets 
-        WHERE channel_id = $1 AND closed = FALSE
-        """, channel.id)
+        ticket = await conn.fetchrow(_SQL_CLAIM_TICKET_BY_CHANNEL, channel.id)
         
         if not ticket:
             await interaction.response.send_message("This is not an open ticket channel.", ephemeral=True)
@@ -865,11 +1242,7 @@ async def handle_claim_ticket(interaction: discord.Interaction):
                 await interaction.response.send_message(f"This ticket is already claimed by {claimed_by.mention}.", ephemeral=True)
             return
         
-        await conn.execute("""
-        UPDATE tickets 
-        SET claimed_by = $1 
-        WHERE channel_id = $2
-        """, interaction.user.id, channel.id)
+        await conn.execute(_SQL_CLAIM_TICKET, interaction.user.id, interaction.user.display_name, channel.id)
     
     await log_ticket_stat("claimed")
     
@@ -880,125 +1253,79 @@ async def handle_claim_ticket(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed)
     
     # Update control message
-    messages = [message async for message in channel.history(limit=10)]
-    for message in messages:
-        if message.components:
-            is_staff_user = is_staff(interaction.user)
-            await message.edit(view=TicketControlView(is_staff=is_staff_user))
-            break
+    await edit_control_message(channel, ticket['control_message_id'], TicketControlView(is_staff=is_staff_user))
 
 async def add_user_to_ticket(interaction: discord.Interaction, user: discord.Member):
     """Add a user to a ticket"""
     channel = interaction.channel
     
     async with pool.acquire() as conn:
-        ticket = await conn.fetchrow("""
-        SELECT user_id, additional_users FROM tickets 
-        WHERE channel_id = $1 AND closed = FALSE
-        """, channel.id)
-        
-        if not ticket:
-            await interaction.followup.send("This is not an open ticket channel.", ephemeral=True)
-            return
-        
-        if user.id == ticket['user_id'] or user.id in ticket['additional_users']:
-            await interaction.followup.send("User already has access to this ticket.", ephemeral=True)
-            return
-        
-        await conn.execute("""
-        UPDATE tickets 
-        SET additional_users = array_append(additional_users, $1)
-        WHERE channel_id = $2
-        """, user.id, channel.id)
-        
-        await channel.set_permissions(user, read_messages=True, send_messages=True)
-        
-        embed = discord.Embed(
-            description=f"✅ {user.mention} has been added to the ticket by {interaction.user.mention}",
-            color=discord.Color.green()
-        )
-        await interaction.followup.send(embed=embed)
+        ticket = await conn.fetchrow(_SQL_ADD_USER_CHECK, user.id, channel.id)
+    
+    if not ticket:
+        await interaction.followup.send("This is not an open ticket channel.", ephemeral=True)
+        return
+    
+    if ticket['present']:
+        await interaction.followup.send("User already has access to this ticket.", ephemeral=True)
+        return
+    
+    # Database and Discord updates are independent, run them together. The UPDATE
+    # checks out its own connection so a failed Discord call can't leave one busy
+    await asyncio.gather(
+        pool.execute(_SQL_ADD_USER, user.id, channel.id),
+        channel.set_permissions(user, read_messages=True, send_messages=True)
+    )
+    
+    embed = discord.Embed(
+        description=f"✅ {user.mention} has been added to the ticket by {interaction.user.mention}",
+        color=discord.Color.green()
+    )
+    await interaction.followup.send(embed=embed)
 
 async def remove_user_from_ticket(interaction: discord.Interaction, user: discord.Member):
     """Remove a user from a ticket"""
     channel = interaction.channel
     
     async with pool.acquire() as conn:
-        ticket = await conn.fetchrow("""
-        SELECT user_id, additional_users FROM tickets 
-        WHERE channel_id = $1 AND closed = FALSE
-        """, channel.id)
-        
-        if not ticket:
-            await interaction.followup.send("This is not an open ticket channel.", ephemeral=True)
-            return
-        
-        if user.id == ticket['user_id']:
-            await interaction.followup.send("Cannot remove the ticket creator.", ephemeral=True)
-            return
-        
-        if user.id not in ticket['additional_users']:
-            await interaction.followup.send("User doesn't have access to this ticket.", ephemeral=True)
-            return
-        
-        await conn.execute("""
-        UPDATE tickets 
-        SET additional_users = array_remove(additional_users, $1)
-        WHERE channel_id = $2
-        """, user.id, channel.id)
-        
-        await channel.set_permissions(user, read_messages=False, send_messages=False)
-        
-        embed = discord.Embed(
-            description=f"❌ {user.mention} has been removed from the ticket by {interaction.user.mention}",
-            color=discord.Color.red()
-        )
-        await interaction.followup.send(embed=embed)
+        ticket = await conn.fetchrow(_SQL_REMOVE_USER_CHECK, user.id, channel.id)
+    
+    if not ticket:
+        await interaction.followup.send("This is not an open ticket channel.", ephemeral=True)
+        return
+    
+    if ticket['is_creator']:
+        await interaction.followup.send("Cannot remove the ticket creator.", ephemeral=True)
+        return
+    
+    if not ticket['present']:
+        await interaction.followup.send("User doesn't have access to this ticket.", ephemeral=True)
+        return
+    
+    # Run together, see add_user_to_ticket
+    await asyncio.gather(
+        pool.execute(_SQL_REMOVE_USER, user.id, channel.id),
+        channel.set_permissions(user, read_messages=False, send_messages=False)
+    )
+    
+    embed = discord.Embed(
+        description=f"❌ {user.mention} has been removed from the ticket by {interaction.user.mention}",
+        color=discord.Color.red()
+    )
+    await interaction.followup.send(embed=embed)
 
 @bot.event
 async def on_message(message):
     if message.author.bot:
         return
     
-    # Check if this is a ticket channel
-    async with pool.acquire() as conn:
-        is_ticket = await conn.fetchval("""
-        SELECT EXISTS(SELECT 1 FROM tickets WHERE channel_id = $1)
-        """, message.channel.id)
-    
-    if is_ticket:
-        # Update user info
-        await track_user(message.author)
-        
-        # Update last activity for the ticket
-        async with pool.acquire() as conn:
-            await conn.execute("""
-            UPDATE tickets 
-            SET last_activity = NOW() 
-            WHERE channel_id = $1
-            """, message.channel.id)
+    # Only open ticket channels are tracked; flush_activity writes them out
+    if message.channel.id in OPEN_TICKET_CHANNELS:
+        _activity_buf[message.channel.id] = datetime.now()
+        _seen_users[message.author.id] = message.author.display_name
     
     await bot.process_commands(message)
 
-@bot.event
-async def on_interaction(interaction: discord.Interaction):
-    try:
-        if interaction.type == discord.InteractionType.component:
-            custom_id = interaction.data["custom_id"]
-            
-            if custom_id == "close_ticket":
-                await handle_close_ticket(interaction)
-            elif custom_id == "claim_ticket":
-                await handle_claim_ticket(interaction)
-            elif custom_id == "add_user":
-                await interaction.response.send_modal(AddUserModal())
-            elif custom_id == "remove_user":
-                await handle_remove_user_interaction(interaction)
-    except Exception as e:
-        print(f"Error in on_interaction: {e}")
-        if not interaction.response.is_done():
-            await interaction.response.send_message("An error occurred while processing your request.", ephemeral=True)
-
 async def handle_remove_user_interaction(interaction: discord.Interaction):
     """Handle the remove user button interaction"""
     await interaction.response.send_message(
@@ -1031,14 +1358,17 @@ async def handle_remove_user_interaction(interaction: discord.Interaction):
 async def resetdb(ctx):
     """Owner-only command to reset database"""
     async with pool.acquire() as conn:
+        # Drop and recreate in one multi-statement execute: a single round-trip
+        # that Postgres runs as one implicit transaction
         await conn.execute("""
         DROP TABLE IF EXISTS archived_tickets CASCADE;
         DROP TABLE IF EXISTS transcripts CASCADE;
         DROP TABLE IF EXISTS tickets CASCADE;
         DROP TABLE IF EXISTS ticket_stats CASCADE;
         DROP TABLE IF EXISTS ticket_setups CASCADE;
-        """)
-    await init_db()
+        """ + _SQL_BOOTSTRAP)
+    
+    OPEN_TICKET_CHANNELS.clear()
     await ctx.send("Database has been reset")
 
 @bot.command()
@@ -1054,21 +1384,26 @@ async def migrate_categories(ctx):
     }
     
     async with pool.acquire() as conn:
-        # Update ticket types in database
-        for old_type, new_type in category_mapping.items():
-            await conn.execute("""
-            UPDATE tickets 
-            SET ticket_type = $1 
-            WHERE ticket_type = $2
-            """, new_type, old_type)
-        
-        # Update category names in the server
-        guild = ctx.guild
-        for old_type, new_type in category_mapping.items():
-            old_category = discord.utils.get(guild.categories, name=TICKET_CATEGORIES.get(old_type, {}).get("name", ""))
-            if old_category:
-                new_name = TICKET_CATEGORIES[new_type]["name"]
-                await old_category.edit(name=new_name)
+        # Update ticket types in database, all mappings in one statement
+        await conn.execute("""
+        UPDATE tickets 
+        SET ticket_type = m.new_type 
+        FROM UNNEST($1::text[], $2::text[]) AS m(old_type, new_type)
+        WHERE tickets.ticket_type = m.old_type
+        """, list(category_mapping.keys()), list(category_mapping.values()))
+    
+    # Update category names in the server
+    guild = ctx.guild
+    categories_by_name = {category.name: category for category in guild.categories}
+    renames = []
+    for old_type, new_type in category_mapping.items():
+        old_info = TICKET_CATEGORIES.get(old_type)
+        old_category = categories_by_name.get(old_info.name) if old_info else None
+        new_name = TICKET_CATEGORIES[new_type].name
+        if old_category and old_category.name != new_name:
+            _category_ids.pop((guild.id, old_category.name), None)
+            renames.append(old_category.edit(name=new_name))
+    await asyncio.gather(*renames)
     
     await ctx.send("Ticket categories migrated successfully!")
 
@@ -1077,4 +1412,16 @@ token = os.getenv('DISCORD_BOT_TOKEN')
 if not token:
     token = input("Please enter your bot token: ")
 
-bot.run(token)
\ No newline at end of file
+async def main():
+    async with bot:
+        await bot.start(token)
+
+setup_logging()
+if uvloop is not None:
+    try:
+        uvloop.run(main())
+    except KeyboardInterrupt:
+        pass
+else:
+    # discord.py logs through the root handler installed above
+    bot.run(token, log_handler=None)
\ No newline at end of file